@@ -4,24 +4,261 @@
 """
 
 import json
+import mmap
+import multiprocessing
 import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from dataclasses import asdict, dataclass, fields
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional, Tuple
 
-def merge_comments(input_dir: str = "data/youtube", output_file: str = "data/youtube/all_comments_merged.json"):
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安装pyarrow时不输出Parquet文件
+    pa = pq = None
+
+try:
+    from tqdm import tqdm
+except ImportError:  # 未安装tqdm时按批次打印进度
+    tqdm = None
+
+# 未安装tqdm时，每处理多少个文件打印一次进度
+PROGRESS_BATCH_SIZE = 100
+
+
+@dataclass(slots=True)
+class Comment:
+    """扁平化后的单条评论（主评论或回复）"""
+    comment_id: str
+    video_id: str
+    video_title: str
+    author_name: str
+    author_channel_id: str
+    text: str
+    like_count: int
+    published_at: str
+    updated_at: str
+    reply_count: int
+    is_reply: bool
+    parent_id: Optional[str]
+
+
+def _loads(data):
+    """解析JSON字节串（支持bytes、memoryview等）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+
+def _dumps(obj, indent: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON字节串"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_DATACLASS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None,
+                      default=asdict).encode('utf-8')
+
+
+def _parquet_schema():
+    """评论表的Parquet列定义"""
+    return pa.schema([
+        ("comment_id", pa.string()),
+        # 同一视频的所有评论共享视频ID和标题，使用字典编码只存储一次
+        ("video_id", pa.dictionary(pa.int32(), pa.string())),
+        ("video_title", pa.dictionary(pa.int32(), pa.string())),
+        ("author_name", pa.string()),
+        ("author_channel_id", pa.string()),
+        ("text", pa.string()),
+        ("like_count", pa.int64()),
+        ("published_at", pa.timestamp("s", tz="UTC")),
+        ("updated_at", pa.timestamp("s", tz="UTC")),
+        ("reply_count", pa.int64()),
+        ("is_reply", pa.bool_()),
+        ("parent_id", pa.string()),
+    ])
+
+
+def _parse_time(value: str) -> Optional[datetime]:
+    """解析API返回的ISO 8601时间，空值返回None；格式错误时抛出ValueError"""
+    if not value:
+        return None
+    # Python 3.11 之前的 fromisoformat 不支持 Z 后缀
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def _to_columns(records: List[Comment]) -> Dict[str, list]:
+    """将评论记录转换为按列存储的字典"""
+    columns = {f.name: [getattr(r, f.name) for r in records] for f in fields(Comment)}
+    columns["published_at"] = [_parse_time(v) for v in columns["published_at"]]
+    columns["updated_at"] = [_parse_time(v) for v in columns["updated_at"]]
+    return columns
+
+
+def _open_parquet_writer(parquet_path: Optional[Path]):
+    """打开Parquet写入器；未安装pyarrow或未指定路径时返回空上下文"""
+    if pq is None or parquet_path is None:
+        return nullcontext()
+    return pq.ParquetWriter(parquet_path, _parquet_schema(), compression="zstd")
+
+
+# 以下两个函数按 Comment 字段顺序传入位置参数，比关键字参数构造更快
+
+def _build_comment(comment: Dict, vid: str, vtitle: str) -> Comment:
+    """由爬虫输出的主评论构造 Comment"""
+    cg = comment.get
+    return Comment(
+        cg("comment_id", ""),
+        vid,
+        vtitle,
+        cg("author_name", ""),
+        cg("author_channel_id", ""),
+        cg("text", ""),
+        int(cg("like_count", 0) or 0),
+        cg("published_at", ""),
+        cg("updated_at", ""),
+        int(cg("reply_count", 0) or 0),
+        False,
+        None,
+    )
+
+
+def _build_reply(reply: Dict, vid: str, vtitle: str) -> Comment:
+    """由爬虫输出的回复构造 Comment"""
+    rg = reply.get
+    return Comment(
+        rg("comment_id", ""),
+        vid,
+        vtitle,
+        rg("author_name", ""),
+        rg("author_channel_id", ""),
+        rg("text", ""),
+        int(rg("like_count", 0) or 0),
+        rg("published_at", ""),
+        rg("updated_at", ""),
+        0,
+        True,
+        rg("parent_id", ""),
+    )
+
+
+def process_file(file_path: Path, to_arrow: bool = False
+                 ) -> Tuple[Dict, bytes, Optional["pa.Table"], Optional[str], Tuple[int, int]]:
+    """
+    解析单个评论文件，将评论（包括回复）扁平化并完成序列化
+    
+    JSON Lines 和 Arrow 表都在此处（子进程中）生成，主进程只负责写入。
+    解析或JSON序列化失败时抛出异常；Arrow转换失败只影响可选的Parquet输出，
+    以错误信息返回，不影响JSON Lines和视频信息。
+    
+    Args:
+        file_path: 评论文件路径
+        to_arrow: 是否同时生成Arrow表（用于Parquet输出）
+    
+    Returns:
+        (视频信息, JSON Lines字节串, Arrow表或None, Arrow转换错误信息或None, (主评论数, 回复数))
+    """
+    with open(file_path, 'rb') as f:
+        data = _loads(f.read())
+    
+    video_info = data.get("video_info", {})
+    comments = data.get("comments", [])
+    comments_count = data.get("comments_count", len(comments))
+    
+    # 视频信息
+    video_entry = {
+        "video_id": video_info.get("video_id", ""),
+        "title": video_info.get("title", ""),
+        "channel_title": video_info.get("channel_title", ""),
+        "published_at": video_info.get("published_at", ""),
+        "view_count": int(video_info.get("view_count", 0) or 0),
+        "like_count": int(video_info.get("like_count", 0) or 0),
+        "comment_count": int(video_info.get("comment_count", 0) or 0),
+        "crawled_comments_count": comments_count,
+        "crawled_at": data.get("crawled_at", "")
+    }
+    
+    records = []
+    main_count = 0
+    reply_count = 0
+    
+    # 同一文件内的评论共享视频ID和标题
+    vid = video_info.get("video_id", "")
+    vtitle = video_info.get("title", "")
+    
+    # 处理评论（包括回复）
+    for comment in comments:
+        # 主评论
+        records.append(_build_comment(comment, vid, vtitle))
+        main_count += 1
+        
+        # 处理回复
+        for reply in comment.get("replies", []):
+            records.append(_build_reply(reply, vid, vtitle))
+            reply_count += 1
+    
+    lines = b"".join(_dumps(record) + b"\n" for record in records)
+    table = None
+    arrow_error = None
+    if to_arrow and records:
+        try:
+            table = pa.Table.from_pydict(_to_columns(records), schema=_parquet_schema())
+        except (ValueError, TypeError, pa.ArrowException) as e:
+            arrow_error = str(e)
+    
+    return video_entry, lines, table, arrow_error, (main_count, reply_count)
+
+
+def _try_process_file(file_path: Path, to_arrow: bool = False) -> Tuple[Optional[Tuple], Optional[str]]:
+    """在子进程中调用 process_file，将异常转为错误信息返回，避免中断其他文件的处理"""
+    try:
+        return process_file(file_path, to_arrow), None
+    except Exception as e:
+        return None, str(e)
+
+
+def merge_comments(input_dir: str = "data/youtube",
+                   output_file: str = "data/youtube/all_comments.jsonl",
+                   manifest_file: str = "data/youtube/manifest.json",
+                   parquet_file: Optional[str] = "data/youtube/all_comments.parquet"):
     """
     合并所有评论文件
     
+    评论以JSON Lines格式（每行一条评论）流式写入 output_file，
+    安装了pyarrow时同时按列写入 parquet_file，供聚类分析直接读取；
+    视频信息和统计数据写入 manifest_file。
+    
     Args:
         input_dir: 输入目录
-        output_file: 输出文件路径
+        output_file: 评论输出文件路径（JSON Lines）
+        manifest_file: 视频信息输出文件路径
+        parquet_file: 评论Parquet输出文件路径，为None时不输出
     """
     input_path = Path(input_dir)
     output_path = Path(output_file)
+    manifest_path = Path(manifest_file)
+    parquet_path = Path(parquet_file) if parquet_file and pq is not None else None
     
     # 确保输出目录存在
     output_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    if parquet_path is not None:
+        parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    elif parquet_file:
+        print("提示: 未安装pyarrow，跳过Parquet输出")
     
     # 获取所有评论文件
     comment_files = sorted(input_path.glob("youtube_comments_*.json"))
@@ -30,131 +267,146 @@ def merge_comments(input_dir: str = "data/youtube", output_file: str = "data/you
         print(f"错误: 在 {input_dir} 目录下未找到评论文件")
         return
     
-    print(f"找到 {len(comment_files)} 个评论文件")
+    file_names = [p.name for p in comment_files]
+    total_files = len(comment_files)
+    print(f"找到 {total_files} 个评论文件")
     print("-" * 50)
     
-    # 合并后的数据结构
-    merged_data = {
+    # 合并后的视频信息（评论直接写入文件，不在内存中保留）
+    manifest = {
         "total_videos": 0,
         "total_comments": 0,
         "merged_at": datetime.now().isoformat(),
-        "videos": [],
-        "all_comments": []  # 扁平化的所有评论，方便聚类分析
+        "comments_file": output_path.name,
+        "parquet_file": parquet_path.name if parquet_path is not None else None,
+        "videos": []
     }
+    main_count = 0
+    reply_count = 0
+    video_stats = Counter()
     
-    # 处理每个文件
-    for idx, file_path in enumerate(comment_files, 1):
-        print(f"[{idx}/{len(comment_files)}] 处理: {file_path.name}")
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            video_info = data.get("video_info", {})
-            comments = data.get("comments", [])
-            comments_count = data.get("comments_count", len(comments))
+    # 多进程并行解析文件，按原顺序在主进程中汇总
+    with open(output_path, 'wb') as out, _open_parquet_writer(parquet_path) as writer, ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = executor.map(partial(_try_process_file, to_arrow=writer is not None),
+                               comment_files, chunksize=8)
+        progress = tqdm(total=total_files, desc="处理评论文件", unit="个") if tqdm is not None else None
+        progress_lines = []
+        for idx, (file_name, (result, error)) in enumerate(zip(file_names, results), 1):
+            if error is not None:
+                line = f"[{idx}/{total_files}] ✗ {file_name} 处理失败: {error}"
+                if progress is not None:
+                    progress.write(line)
+                    progress.update()
+                else:
+                    progress_lines.append(line)
+                continue
             
-            # 添加视频信息
-            video_entry = {
-                "video_id": video_info.get("video_id", ""),
-                "title": video_info.get("title", ""),
-                "channel_title": video_info.get("channel_title", ""),
-                "published_at": video_info.get("published_at", ""),
-                "view_count": video_info.get("view_count", "0"),
-                "like_count": video_info.get("like_count", "0"),
-                "comment_count": video_info.get("comment_count", "0"),
-                "crawled_comments_count": comments_count,
-                "crawled_at": data.get("crawled_at", "")
-            }
-            merged_data["videos"].append(video_entry)
+            video_entry, lines, table, arrow_error, (file_main_count, file_reply_count) = result
+            manifest["videos"].append(video_entry)
             
-            # 处理评论（包括回复）
-            for comment in comments:
-                video_id = video_info.get("video_id", "")
-                
-                # 主评论
-                main_comment = {
-                    "comment_id": comment.get("comment_id", ""),
-                    "video_id": video_id,
-                    "video_title": video_info.get("title", ""),
-                    "author_name": comment.get("author_name", ""),
-                    "author_channel_id": comment.get("author_channel_id", ""),
-                    "text": comment.get("text", ""),
-                    "like_count": comment.get("like_count", 0),
-                    "published_at": comment.get("published_at", ""),
-                    "updated_at": comment.get("updated_at", ""),
-                    "reply_count": comment.get("reply_count", 0),
-                    "is_reply": False,
-                    "parent_id": None
-                }
-                merged_data["all_comments"].append(main_comment)
-                
-                # 处理回复
-                replies = comment.get("replies", [])
-                for reply in replies:
-                    reply_comment = {
-                        "comment_id": reply.get("comment_id", ""),
-                        "video_id": video_id,
-                        "video_title": video_info.get("title", ""),
-                        "author_name": reply.get("author_name", ""),
-                        "author_channel_id": reply.get("author_channel_id", ""),
-                        "text": reply.get("text", ""),
-                        "like_count": reply.get("like_count", 0),
-                        "published_at": reply.get("published_at", ""),
-                        "updated_at": reply.get("updated_at", ""),
-                        "reply_count": 0,
-                        "is_reply": True,
-                        "parent_id": reply.get("parent_id", "")
-                    }
-                    merged_data["all_comments"].append(reply_comment)
+            out.write(lines)
+            if writer is not None and table is not None:
+                writer.write_table(table)
+            if arrow_error is not None:
+                line = f"[{idx}/{total_files}] ⚠ {file_name} 未写入Parquet: {arrow_error}"
+                if progress is not None:
+                    progress.write(line)
+                else:
+                    progress_lines.append(line)
             
-            merged_data["total_videos"] += 1
-            merged_data["total_comments"] += len(comments)
+            main_count += file_main_count
+            reply_count += file_reply_count
+            video_stats[video_entry["video_id"]] += file_main_count + file_reply_count
             
-            print(f"  ✓ 视频: {video_info.get('title', 'Unknown')[:50]}...")
-            print(f"  ✓ 评论数: {len(comments)}")
+            manifest["total_videos"] += 1
+            manifest["total_comments"] += file_main_count
             
-        except Exception as e:
-            print(f"  ✗ 处理文件失败: {e}")
-            continue
+            if progress is not None:
+                progress.update()
+            else:
+                progress_lines.append(f"[{idx}/{total_files}] ✓ {file_name}: "
+                                      f"{video_entry['title'][:50] or 'Unknown'}... ({file_main_count} 条评论)")
+                if len(progress_lines) >= PROGRESS_BATCH_SIZE:
+                    print("\n".join(progress_lines))
+                    progress_lines.clear()
+        
+        if progress is not None:
+            progress.close()
+        elif progress_lines:
+            print("\n".join(progress_lines))
     
-    # 保存合并后的数据
+    # 保存视频信息
     print("\n" + "=" * 50)
     print("保存合并数据...")
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(merged_data, f, ensure_ascii=False, indent=2)
+    with open(manifest_path, 'wb') as f:
+        f.write(_dumps(manifest, indent=True))
     
     print(f"✓ 合并完成!")
-    print(f"  - 总视频数: {merged_data['total_videos']}")
-    print(f"  - 总评论数: {len(merged_data['all_comments'])}")
+    print(f"  - 总视频数: {manifest['total_videos']}")
+    print(f"  - 总评论数: {main_count + reply_count}")
     print(f"  - 输出文件: {output_path.absolute()}")
+    if parquet_path is not None:
+        print(f"  - Parquet文件: {parquet_path.absolute()}")
+    print(f"  - 视频信息: {manifest_path.absolute()}")
     
     # 生成统计信息
     print("\n" + "=" * 50)
     print("统计信息:")
-    print(f"  - 视频总数: {merged_data['total_videos']}")
-    print(f"  - 评论总数（含回复）: {len(merged_data['all_comments'])}")
-    
-    # 统计主评论和回复
-    main_comments = [c for c in merged_data['all_comments'] if not c['is_reply']]
-    replies = [c for c in merged_data['all_comments'] if c['is_reply']]
-    print(f"  - 主评论数: {len(main_comments)}")
-    print(f"  - 回复数: {len(replies)}")
-    
-    # 按视频统计
-    video_stats = {}
-    for comment in merged_data['all_comments']:
-        video_id = comment['video_id']
-        if video_id not in video_stats:
-            video_stats[video_id] = 0
-        video_stats[video_id] += 1
+    print(f"  - 视频总数: {manifest['total_videos']}")
+    print(f"  - 评论总数（含回复）: {main_count + reply_count}")
+    print(f"  - 主评论数: {main_count}")
+    print(f"  - 回复数: {reply_count}")
     
     print(f"\n各视频评论数:")
-    for video in merged_data['videos']:
-        video_id = video['video_id']
-        count = video_stats.get(video_id, 0)
-        print(f"  - {video['title'][:40]}... ({count} 条评论)")
+    for video in manifest['videos']:
+        print(f"  - {video['title'][:40]}... ({video_stats[video['video_id']]} 条评论)")
+
+
+def load_merged(path: str):
+    """
+    读取合并后的JSON文件（如 manifest.json）
+    
+    通过内存映射读取，避免将大文件先复制到Python缓冲区。
+    
+    Args:
+        path: JSON文件路径
+    
+    Returns:
+        解析后的数据
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return _loads(b"")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return _loads(view)
+
+
+def iter_comments(path: str) -> Iterator[Dict]:
+    """
+    逐条读取 merge_comments 输出的JSON Lines评论文件
+    
+    Args:
+        path: JSON Lines文件路径
+    
+    Yields:
+        评论字典
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            size = len(mm)
+            while start < size:
+                end = mm.find(b"\n", start)
+                if end == -1:
+                    end = size
+                if end > start:
+                    yield _loads(mm[start:end])
+                start = end + 1
 
 
 if __name__ == "__main__":
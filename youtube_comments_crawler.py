@@ -13,16 +13,43 @@ YouTube视频评论爬虫脚本
 使用YouTube Data API v3获取视频评论
 """
 
+import asyncio
+import importlib.util
 import json
 import os
 import re
 import sys
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, List, Optional
 from urllib.parse import urlparse, parse_qs
 
 import httpx
 
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
+
+# 安装 httpx[http2] 后启用HTTP/2，多个请求复用同一连接
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# YouTube URL 匹配规则
+_YOUTU_BE = re.compile(r'youtu\.be/([a-zA-Z0-9_-]+)')
+_YT_WATCH = re.compile(r'(?:youtube\.com/watch\?v=|youtube\.com/embed/)([a-zA-Z0-9_-]+)')
+
+# API响应字段过滤，只返回用到的字段
+_SNIPPET_FIELDS = "authorDisplayName,authorChannelId/value,textDisplay,likeCount,publishedAt,updatedAt"
+_VIDEO_FIELDS = (
+    "items(id,snippet(title,description,channelTitle,publishedAt),"
+    "statistics(viewCount,likeCount,commentCount))"
+)
+_COMMENT_THREAD_FIELDS = (
+    f"nextPageToken,items(id,snippet(topLevelComment(id,snippet({_SNIPPET_FIELDS})),totalReplyCount),"
+    f"replies/comments(id,snippet({_SNIPPET_FIELDS},parentId)))"
+)
+_REPLY_FIELDS = f"nextPageToken,items(id,snippet({_SNIPPET_FIELDS},parentId))"
+
 
 def extract_video_id(url: str) -> Optional[str]:
     """
@@ -38,16 +65,16 @@ def extract_video_id(url: str) -> Optional[str]:
         视频ID，如果无法提取则返回None
     """
     # 匹配 youtu.be 格式
-    match = re.search(r'youtu\.be/([a-zA-Z0-9_-]+)', url)
+    match = _YOUTU_BE.search(url)
     if match:
         return match.group(1)
     
     # 匹配 youtube.com/watch?v= 格式
-    match = re.search(r'(?:youtube\.com/watch\?v=|youtube\.com/embed/)([a-zA-Z0-9_-]+)', url)
+    match = _YT_WATCH.search(url)
     if match:
         return match.group(1)
     
-    # 使用urllib解析
+    # 正则均未匹配时才使用urllib解析
     parsed = urlparse(url)
     if 'youtu.be' in parsed.netloc:
         return parsed.path.lstrip('/')
@@ -59,19 +86,85 @@ def extract_video_id(url: str) -> Optional[str]:
     return None
 
 
+# 可重试的HTTP请求的最大尝试次数及最长等待秒数（429限流和5xx服务端错误）
+MAX_ATTEMPTS = 5
+MAX_RETRY_WAIT = 30
+
+# 并发获取回复的最大请求数，避免过快消耗API配额
+MAX_CONCURRENT_REPLY_FETCHES = 10
+
+# 所有爬虫实例共享的HTTP客户端，复用连接和TLS会话
+_shared_client: Optional[httpx.AsyncClient] = None
+
+
+def get_shared_client() -> httpx.AsyncClient:
+    """获取（必要时创建）共享的HTTP客户端"""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        # 未显式设置 Accept-Encoding：httpx 会在安装了brotli时自动加入 br
+        _shared_client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=20),
+        )
+    return _shared_client
+
+
+async def close_shared_client():
+    """关闭共享的HTTP客户端"""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+
+
 class YouTubeCommentsCrawler:
     """YouTube评论爬虫类"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client: Optional[httpx.AsyncClient] = None):
         """
         初始化爬虫
         
         Args:
             api_key: Google API Key (YouTube Data API v3)
+            client: 自定义HTTP客户端，默认使用模块共享的客户端（可被多个爬虫实例复用）
         """
         self.api_key = api_key
         self.base_url = "https://www.googleapis.com/youtube/v3"
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self._client = client
+        self._reply_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REPLY_FETCHES)
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """当前使用的HTTP客户端"""
+        return self._client if self._client is not None else get_shared_client()
+    
+    async def _get(self, url: str, params: Dict) -> httpx.Response:
+        """
+        发送GET请求，遇到429或5xx错误时按指数退避重试
+        
+        Args:
+            url: 请求地址
+            params: 请求参数
+        
+        Returns:
+            状态码正常的响应
+        
+        Raises:
+            httpx.HTTPStatusError: 不可重试的错误（如403配额用尽）或重试次数用尽
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            response = await self.client.get(url, params=params)
+            try:
+                response.raise_for_status()
+                return response
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if attempt == MAX_ATTEMPTS - 1 or (status != 429 and status < 500):
+                    raise
+                wait = min(2 ** attempt, MAX_RETRY_WAIT)
+                print(f"HTTP错误 {status}，{wait} 秒后重试...")
+                await asyncio.sleep(wait)
     
     async def get_video_info(self, video_id: str) -> Optional[Dict]:
         """
@@ -87,12 +180,12 @@ class YouTubeCommentsCrawler:
         params = {
             "part": "snippet,statistics",
             "id": video_id,
+            "fields": _VIDEO_FIELDS,
             "key": self.api_key
         }
         
         try:
-            response = await self.client.get(url, params=params)
-            response.raise_for_status()
+            response = await self._get(url, params)
             data = response.json()
             
             if data.get("items"):
@@ -103,19 +196,72 @@ class YouTubeCommentsCrawler:
                     "description": item["snippet"]["description"],
                     "channel_title": item["snippet"]["channelTitle"],
                     "published_at": item["snippet"]["publishedAt"],
-                    "view_count": item["statistics"].get("viewCount", 0),
-                    "like_count": item["statistics"].get("likeCount", 0),
-                    "comment_count": item["statistics"].get("commentCount", 0),
+                    "view_count": int(item["statistics"].get("viewCount", 0) or 0),
+                    "like_count": int(item["statistics"].get("likeCount", 0) or 0),
+                    "comment_count": int(item["statistics"].get("commentCount", 0) or 0),
                 }
         except Exception as e:
             print(f"获取视频信息失败: {e}")
             return None
     
+    @staticmethod
+    def _parse_reply(reply: Dict) -> Dict:
+        """将API返回的回复数据转换为评论字典"""
+        reply_snippet = reply["snippet"]
+        return {
+            "comment_id": reply["id"],
+            "author_name": reply_snippet["authorDisplayName"],
+            "author_channel_id": reply_snippet.get("authorChannelId", {}).get("value", ""),
+            "text": reply_snippet["textDisplay"],
+            "like_count": int(reply_snippet.get("likeCount", 0) or 0),
+            "published_at": reply_snippet["publishedAt"],
+            "updated_at": reply_snippet.get("updatedAt", ""),
+            "parent_id": reply_snippet.get("parentId", "")
+        }
+    
+    async def _fetch_replies(self, parent_id: str) -> Optional[List[Dict]]:
+        """
+        获取某条主评论的全部回复（commentThreads 接口最多只内嵌5条回复）
+        
+        Args:
+            parent_id: 主评论ID
+        
+        Returns:
+            回复列表，获取失败时返回None
+        """
+        url = f"{self.base_url}/comments"
+        params = {
+            "part": "snippet",
+            "parentId": parent_id,
+            "maxResults": 100,
+            "fields": _REPLY_FIELDS,
+            "key": self.api_key
+        }
+        
+        replies = []
+        
+        try:
+            async with self._reply_semaphore:
+                while True:
+                    response = await self._get(url, params)
+                    data = response.json()
+                    replies.extend(self._parse_reply(reply) for reply in data.get("items", []))
+                    
+                    next_page_token = data.get("nextPageToken")
+                    if not next_page_token:
+                        return replies
+                    params["pageToken"] = next_page_token
+        except Exception as e:
+            print(f"获取评论 {parent_id} 的回复失败: {e}")
+            return None
+    
     async def get_comments(self, video_id: str, max_results: int = 100, 
                           order: str = "relevance") -> List[Dict]:
         """
         获取视频评论
         
+        下一页在解析当前页的同时预先请求，回复则并发获取。
+        
         Args:
             video_id: YouTube视频ID
             max_results: 最大获取评论数量（默认100，API限制单次最多100）
@@ -125,74 +271,43 @@ class YouTubeCommentsCrawler:
             评论列表
         """
         all_comments = []
-        next_page_token = None
-        total_fetched = 0
+        # 已请求的页面数据，最多预取2页；None 表示没有更多页面
+        pages: asyncio.Queue = asyncio.Queue(maxsize=2)
         
         print(f"开始获取视频 {video_id} 的评论...")
         
-        while total_fetched < max_results:
-            # 计算本次请求的数量
-            current_max = min(100, max_results - total_fetched)  # API单次最多100条
-            
-            url = f"{self.base_url}/commentThreads"
-            params = {
-                "part": "snippet,replies",
-                "videoId": video_id,
-                "maxResults": current_max,
-                "order": order,
-                "key": self.api_key
-            }
-            
-            if next_page_token:
-                params["pageToken"] = next_page_token
+        async def fetch_pages():
+            next_page_token = None
+            total_requested = 0
             
             try:
-                response = await self.client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                # 处理评论数据
-                items = data.get("items", [])
-                for item in items:
-                    top_level_comment = item["snippet"]["topLevelComment"]["snippet"]
+                while total_requested < max_results:
+                    # 计算本次请求的数量
+                    current_max = min(100, max_results - total_requested)  # API单次最多100条
                     
-                    comment_data = {
-                        "comment_id": item["snippet"]["topLevelComment"]["id"],
-                        "author_name": top_level_comment["authorDisplayName"],
-                        "author_channel_id": top_level_comment.get("authorChannelId", {}).get("value", ""),
-                        "text": top_level_comment["textDisplay"],
-                        "like_count": top_level_comment.get("likeCount", 0),
-                        "published_at": top_level_comment["publishedAt"],
-                        "updated_at": top_level_comment.get("updatedAt", ""),
-                        "reply_count": item["snippet"].get("totalReplyCount", 0),
-                        "replies": []
+                    url = f"{self.base_url}/commentThreads"
+                    params = {
+                        "part": "snippet,replies",
+                        "videoId": video_id,
+                        "maxResults": current_max,
+                        "order": order,
+                        "fields": _COMMENT_THREAD_FIELDS,
+                        "key": self.api_key
                     }
                     
-                    # 获取回复评论
-                    if "replies" in item:
-                        for reply in item["replies"]["comments"]:
-                            reply_snippet = reply["snippet"]
-                            comment_data["replies"].append({
-                                "comment_id": reply["id"],
-                                "author_name": reply_snippet["authorDisplayName"],
-                                "author_channel_id": reply_snippet.get("authorChannelId", {}).get("value", ""),
-                                "text": reply_snippet["textDisplay"],
-                                "like_count": reply_snippet.get("likeCount", 0),
-                                "published_at": reply_snippet["publishedAt"],
-                                "updated_at": reply_snippet.get("updatedAt", ""),
-                                "parent_id": reply_snippet.get("parentId", "")
-                            })
+                    if next_page_token:
+                        params["pageToken"] = next_page_token
+                    
+                    response = await self._get(url, params)
+                    data = response.json()
+                    await pages.put(data)
+                    total_requested += len(data.get("items", []))
+                    
+                    # 检查是否有下一页
+                    next_page_token = data.get("nextPageToken")
+                    if not next_page_token:
+                        break
                     
-                    all_comments.append(comment_data)
-                    total_fetched += 1
-                
-                # 检查是否有下一页
-                next_page_token = data.get("nextPageToken")
-                if not next_page_token:
-                    break
-                
-                print(f"已获取 {total_fetched} 条评论...")
-                
             except httpx.HTTPStatusError as e:
                 if e.response.status_code == 403:
                     error_data = e.response.json()
@@ -204,10 +319,61 @@ class YouTubeCommentsCrawler:
                     print("3. API配额是否已用完")
                 else:
                     print(f"HTTP错误: {e.response.status_code} - {e.response.text}")
-                break
             except Exception as e:
                 print(f"获取评论时出错: {e}")
-                break
+            finally:
+                await pages.put(None)
+        
+        producer = asyncio.create_task(fetch_pages())
+        try:
+            while True:
+                data = await pages.get()
+                if data is None:
+                    break
+                
+                # 处理评论数据
+                page_comments = []
+                try:
+                    for item in data.get("items", []):
+                        top_level_comment = item["snippet"]["topLevelComment"]["snippet"]
+                    
+                        comment_data = {
+                            "comment_id": item["snippet"]["topLevelComment"]["id"],
+                            "author_name": top_level_comment["authorDisplayName"],
+                            "author_channel_id": top_level_comment.get("authorChannelId", {}).get("value", ""),
+                            "text": top_level_comment["textDisplay"],
+                            "like_count": int(top_level_comment.get("likeCount", 0) or 0),
+                            "published_at": top_level_comment["publishedAt"],
+                            "updated_at": top_level_comment.get("updatedAt", ""),
+                            "reply_count": int(item["snippet"].get("totalReplyCount", 0) or 0),
+                            "replies": []
+                        }
+                    
+                        # 获取内嵌的回复评论
+                        if "replies" in item:
+                            for reply in item["replies"]["comments"]:
+                                comment_data["replies"].append(self._parse_reply(reply))
+                    
+                        page_comments.append(comment_data)
+                
+                    # 内嵌回复不完整的评论，并发获取全部回复
+                    incomplete = [c for c in page_comments if c["reply_count"] > len(c["replies"])]
+                    if incomplete:
+                        results = await asyncio.gather(
+                            *[self._fetch_replies(c["comment_id"]) for c in incomplete])
+                        for comment_data, replies in zip(incomplete, results):
+                            if replies is not None:
+                                comment_data["replies"] = replies
+                except Exception as e:
+                    # 保留本页已解析的评论，与之前已获取的评论一起返回
+                    print(f"获取评论时出错: {e}")
+                    all_comments.extend(page_comments)
+                    break
+                
+                all_comments.extend(page_comments)
+                print(f"已获取 {len(all_comments)} 条评论...")
+        finally:
+            producer.cancel()
         
         print(f"共获取 {len(all_comments)} 条评论")
         return all_comments
@@ -225,12 +391,13 @@ class YouTubeCommentsCrawler:
         Returns:
             保存的文件路径
         """
-        os.makedirs(output_dir, exist_ok=True)
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
         
         # 生成文件名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         video_id = video_info["video_id"]
-        filename = f"{output_dir}/youtube_comments_{video_id}_{timestamp}.json"
+        filename = os.fspath(output_path / f"youtube_comments_{video_id}_{timestamp}.json")
         
         # 组织数据
         output_data = {
@@ -241,15 +408,21 @@ class YouTubeCommentsCrawler:
         }
         
         # 保存文件
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            # 直接写入orjson生成的UTF-8字节，避免再次编码
+            with open(filename, "wb") as f:
+                f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+        else:
+            with open(filename, "w", encoding="utf-8") as f:
+                json.dump(output_data, f, ensure_ascii=False, indent=2)
         
         print(f"评论已保存到: {filename}")
         return filename
     
     async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
+        """关闭自定义HTTP客户端；共享客户端不在此关闭，由 close_shared_client() 在程序结束时统一关闭"""
+        if self._client is not None:
+            await self._client.aclose()
 
 
 async def main():
@@ -329,9 +502,9 @@ async def main():
     
     finally:
         await crawler.close()
+        await close_shared_client()
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
 